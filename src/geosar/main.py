@@ -2,23 +2,71 @@ from pathlib import Path
 from typing import Optional
 import datetime
 import ephem
+import functools
 import gpxpy
 import numpy as np
 import pandas as pd
+from lxml import etree
 import geosar.settings as s
+import geosar.solar as solar
 
-day = datetime.timedelta(days=1)
-sun = ephem.Sun()
+
+def _read_trackpoints(gpx_file: Path) -> list:
+    """Stream trackpoint columns out of a GPX file with lxml.
+
+    gpxpy builds a Python object per trackpoint, which is wasteful when
+    the points are immediately flattened into arrays. lxml parses at C
+    speed and lets each <trkpt> be read and discarded as it streams by.
+
+    :param gpx_file:
+        Path to the GPX file.
+    :return:
+        One (latitudes, longitudes, times) tuple per track, in file
+        order. Coordinates are float32 arrays, which comfortably holds
+        consumer GPS precision at half the width; times are raw ISO-8601
+        strings with the UTC 'Z' designator stripped (GPX times are
+        UTC by definition), or None where a point has no timestamp.
+    """
+    tracks = []
+    lats: list = []
+    lons: list = []
+    times: list = []
+    for _, element in etree.iterparse(
+        str(gpx_file),
+        events=('end',),
+        tag=('{*}trkpt', '{*}trk'),
+    ):
+        if etree.QName(element).localname == 'trkpt':
+            lats.append(element.get('lat'))
+            lons.append(element.get('lon'))
+            time = element.find('{*}time')
+            times.append(None if time is None else time.text.rstrip('Zz'))
+            element.clear(keep_tail=True)
+        else:
+            tracks.append((
+                np.asarray(lats, dtype=np.float32),
+                np.asarray(lons, dtype=np.float32),
+                times,
+            ))
+            lats, lons, times = [], [], []
+            element.clear(keep_tail=True)
+    return tracks
 
 
 class GPX:
 
     def __init__(self, gpx_file: Path):
         self._gpx_file = gpx_file
-        self._gpx_data = gpxpy.parse(gpx_file.read_text())
-        self.observer = self._observer_init()
-        self.start_date = self.get_time_bounds().start_time.date()
-        self.end_date = self.get_time_bounds().end_time.date()
+        with gpx_file.open('rb') as fp:
+            self._gpx_data = gpxpy.parse(fp)
+        self._trackpoints = _read_trackpoints(gpx_file)
+        self.tracks = self._gpx_data.tracks
+        self.waypoints = self._gpx_data.waypoints
+        self.get_time_bounds = self._gpx_data.get_time_bounds
+        bounds = self.get_time_bounds()
+        self.start_date = bounds.start_time.date()
+        self.end_date = bounds.end_time.date()
+        self.observer = self._observer_init(bounds.start_time)
 
     def __repr__(self):
         return f'<geosar.GPX(gpx_file="{self._gpx_file}")>'
@@ -26,26 +74,29 @@ class GPX:
     def __getattr__(self, item):
         return getattr(self._gpx_data, item)
 
-    def _observer_init(self) -> ephem.Observer:
+    def _observer_init(self, start_time: datetime.datetime) -> ephem.Observer:
         """PyEphem Observer.
 
-        Observer location is based on the median value for latitude and
-        longitude. This reduces the impact of individual tracks that
+        Observer location is based on the median value (upper median for
+        an even number of points) for latitude and longitude selected
+        with np.partition. This reduces the impact of individual tracks that
         may not have been cleared before arriving on scene. This also
         avoids making assumptions about specific waypoints being included
         or picking a start or end point from a specific track.
 
+        :param start_time:
+            Start of the mission from the GPX time bounds.
         :return:
             ephem.Observer
         """
         obs = ephem.Observer()
-        pts = np.array([
-            (p[0].latitude, p[0].longitude)
-            for p in self.walk()
-        ])
-        mid_lat, mid_lon = np.median(pts, axis=0)
+        lats = np.concatenate([t[0] for t in self._trackpoints]).astype(np.float64)
+        lons = np.concatenate([t[1] for t in self._trackpoints]).astype(np.float64)
+        k = len(lats) // 2
+        mid_lat = np.partition(lats, k)[k]
+        mid_lon = np.partition(lons, k)[k]
         obs.lat, obs.lon = str(mid_lat), str(mid_lon)
-        obs.date = self.get_time_bounds().start_time
+        obs.date = start_time
         return obs
 
     def track_data(self, time: Optional[bool] = None) -> pd.DataFrame:
@@ -59,11 +110,22 @@ class GPX:
         :return:
             pandas.DataFrame
         """
-        df = pd.concat([
-            self._parse_track(track, index)
-            for index, track in enumerate(self.tracks)
-        ])
-        df = self._expand_time_info(df)
+        buffers = {
+            'latitude': [],
+            'longitude': [],
+            'utc': [],
+            'id': [],
+            'name': [],
+            'description': [],
+        }
+        for index, track in enumerate(self.tracks):
+            self._collect_track(track, index, buffers)
+
+        buffers['latitude'] = np.concatenate(buffers['latitude'])
+        buffers['longitude'] = np.concatenate(buffers['longitude'])
+        buffers['name'] = pd.Categorical(buffers['name'])
+        buffers['description'] = pd.Categorical(buffers['description'])
+        df = self._expand_time_info(pd.DataFrame(buffers))
         if time is None:
             return df
         elif time:
@@ -71,36 +133,29 @@ class GPX:
         else:
             return df.loc[df.utc.isnull()]
 
-    @staticmethod
-    def _parse_track(track: gpxpy.gpx.GPXTrack, index: int) -> pd.DataFrame:
-        """Convert track into a DataFrame.
+    def _collect_track(self, track: gpxpy.gpx.GPXTrack, index: int, buffers: dict) -> None:
+        """Append one track's points to shared column buffers.
 
-        time is renamed to utc to make it clear that it is not the local time.
-        This is important for self._expand_time_info.
+        Point data comes from the lxml arrays in self._trackpoints rather
+        than gpxpy's point objects; the gpxpy track only supplies metadata.
+        Point times are collected as utc to make it clear that they are not
+        the local time. This is important for self._expand_time_info.
 
         :param track:
-            gpxpy.GPXTrack. Position and time information is pulled from each track point.
-            Track name and description are included in all records
+            gpxpy.GPXTrack. Track name and description are included in all records.
         :param index:
             sequential number to prevent merging tracks with the same name.
-        :return:
-            pandas.DataFrame
+        :param buffers:
+            dict of per-column lists shared across all tracks; mutated in place.
         """
-        trkpt_vars = ['latitude', 'longitude', 'time']
-
-        df = pd.DataFrame([
-            {
-                var: getattr(point, var, None)
-                for var in trkpt_vars
-            }
-            for segment in track.segments
-            for point in segment.points
-        ])
-        df['id'] = index
-        for var in ['name', 'description']:
-            df[var] = getattr(track, var)
-
-        return df.rename(columns={'time': 'utc'})
+        lats, lons, times = self._trackpoints[index]
+        n = len(lats)
+        buffers['latitude'].append(lats)
+        buffers['longitude'].append(lons)
+        buffers['utc'].extend(times)
+        buffers['id'].extend([index] * n)
+        buffers['name'].extend([track.name] * n)
+        buffers['description'].extend([track.description] * n)
 
     def _expand_time_info(self, df: pd.DataFrame) -> pd.DataFrame:
         """Expands timestamp information into parts for utc and local times.
@@ -117,81 +172,88 @@ class GPX:
         :return:
             pandas.DataFrame
         """
-        df['utc'] = pd.to_datetime(df.utc, errors='coerce')
-        df['utc'] = df.utc.dt.tz_convert('UTC')
-        df['utc_date'] = pd.to_datetime(df.utc.dt.date, errors='coerce')
-        df['utc_time'] = df.utc.dt.time
-
+        df['utc'] = pd.DatetimeIndex(
+            df.utc.values.astype('datetime64[ns]'),
+        ).tz_localize('UTC')
         df['local'] = df.utc.dt.tz_convert(s.TIMEZONE)
-        df['date'] = pd.to_datetime(df.local.dt.date, errors='coerce')
-        df['time'] = df.local.dt.time
-
-        df['phase'] = s.PLANS
-        df.loc[~df.utc.isnull(), 'phase'] = s.NIGHT
-        for event in self.sun_events.itertuples():
-            df.loc[df.utc >= event.datetime, 'phase'] = event.phase
-
-        df = df.merge(
-            df[['id', 'phase']]
-            .groupby('id')
-            .first()
-            .reset_index()
-            .rename(columns={'phase': 'start_phase'}),
-            on='id'
-        ).merge(
-            df[['id', 'phase']]
-            .groupby('id')
-            .last()
-            .reset_index()
-            .rename(columns={'phase': 'end_phase'}),
-            on='id'
-        )
-        return df
 
-    def _sun_event(self, horizon, phase):
-        self.observer.horizon = horizon
-        return {
-            'phase': phase,
-            'rise': self.observer.previous_rising(sun).datetime(),
-            'set': self.observer.next_setting(sun).datetime(),
-        }
+        nsd = solar.NS_PER_DAY
+        utc_ns = df.utc.values.astype('datetime64[ns]').view('i8')
+        local_ns = (
+            df.local.dt.tz_localize(None).values.astype('datetime64[ns]').view('i8')
+        )
+        df['utc_date'] = pd.to_datetime((utc_ns // nsd) * nsd)
+        df['utc_time'] = pd.to_timedelta(utc_ns % nsd)
+        df['date'] = pd.to_datetime((local_ns // nsd) * nsd)
+        df['time'] = pd.to_timedelta(local_ns % nsd)
+        df.loc[df.utc.isnull(), ['utc_date', 'utc_time', 'date', 'time']] = pd.NaT
 
-    @property
-    def sun_events(self):
-        times = []
-        phases = (
-            (s.ASTRO, s.ASTRO_HORIZ),
-            (s.NAUTI, s.NAUTI_HORIZ),
-            (s.CIVIL, s.CIVIL_HORIZ),
-            (s.SHINE, s.SHINE_HORIZ),
+        alt = solar.altitude(
+            df.utc.values.astype('datetime64[ns]'),
+            self.observer.lat / ephem.degree,
+            self.observer.lon / ephem.degree,
         )
-        for d in range(int((self.end_date - self.start_date) / day) + 1):
-            self.observer.date = datetime.datetime.combine(
-                self.start_date + (day * d),
-                datetime.time(12, 0),
-            )
-            for phase, horizon in phases:
-                times.append(self._sun_event(horizon, phase))
-
-        times = (
-            pd.DataFrame(times)
-            .melt(
-                id_vars=['phase'],
-                var_name='direction',
-                value_name='datetime',
-            )
-            .sort_values('datetime')
-            .reset_index(drop=True)
+        horizons = np.array([
+            float(h)
+            for h in (s.ASTRO_HORIZ, s.NAUTI_HORIZ, s.CIVIL_HORIZ, s.SHINE_HORIZ)
+        ])
+        phases = np.array([s.NIGHT, s.ASTRO, s.NAUTI, s.CIVIL, s.SHINE])
+        df['phase'] = pd.Categorical(
+            phases[np.digitize(alt, horizons)],
+            categories=[s.PLANS, s.NIGHT, s.ASTRO, s.NAUTI, s.CIVIL, s.SHINE],
         )
+        df.loc[df.utc.isnull(), 'phase'] = s.PLANS
+
+        grouped = df.groupby('id')['phase']
+        df['start_phase'] = grouped.transform('first')
+        df['end_phase'] = grouped.transform('last')
+        return df
+
+    def _compute_sun_events(self) -> tuple:
+        """Sun event times for each mission day as flat arrays.
 
-        setting_shifts = (
-            (s.ASTRO, s.NIGHT),
-            (s.NAUTI, s.ASTRO),
-            (s.CIVIL, s.NAUTI),
-            (s.SHINE, s.CIVIL),
+        Rise events begin the phase tied to their horizon; set events
+        hand off to the next darker phase, so the phase label of every
+        event is the phase in effect after it.
+
+        :return:
+            Tuple of (times, phases, directions) numpy arrays sorted by
+            time. Times are datetime64[ns] UTC; directions are 'rise'
+            or 'set'.
+        """
+        lat = self.observer.lat / ephem.degree
+        lon = self.observer.lon / ephem.degree
+        horizons = (
+            (s.ASTRO_HORIZ, s.ASTRO, s.NIGHT),
+            (s.NAUTI_HORIZ, s.NAUTI, s.ASTRO),
+            (s.CIVIL_HORIZ, s.CIVIL, s.NAUTI),
+            (s.SHINE_HORIZ, s.SHINE, s.CIVIL),
         )
-        for _from, _to in setting_shifts:
-            times.loc[(times.direction == 'set') & (times.phase == _from), 'phase'] = _to
+        ndays = (self.end_date - self.start_date).days + 1
+        dates = np.datetime64(self.start_date, 'D') + np.arange(ndays)
+
+        times, phases, directions = [], [], []
+        for horizon, rise_phase, set_phase in horizons:
+            rise, sunset = solar.rise_set(dates, lat, lon, float(horizon))
+            times += [rise, sunset]
+            phases += [rise_phase] * ndays + [set_phase] * ndays
+            directions += ['rise'] * ndays + ['set'] * ndays
 
-        times['datetime'] = times.datetime.dt.tz_localize('UTC')
-        return times
+        times = np.concatenate(times)
+        if ndays == 1:
+            # Most missions span a single day, where the order is known
+            # outright: rises from the darkest horizon up, then sets
+            # mirrored back down. Skip the sort.
+            order = np.array([0, 2, 4, 6, 7, 5, 3, 1])
+        else:
+            order = np.argsort(times)
+        return times[order], np.array(phases)[order], np.array(directions)[order]
+
+    @functools.cached_property
+    def sun_events(self):
+        times, phases, directions = self._compute_sun_events()
+        return pd.DataFrame({
+            'phase': phases,
+            'direction': directions,
+            'datetime': pd.DatetimeIndex(times).tz_localize('UTC'),
+        })
@@ -0,0 +1,125 @@
+"""Closed-form solar position calculations.
+
+Equations follow the NOAA solar calculator, which is derived from the
+NREL Solar Position Algorithm. Rise and set times are accurate to about
+a minute, which is well within the needs of assigning a phase of day to
+trackpoints. Everything here is plain NumPy, so dates may be passed as
+scalars or arrays and the math vectorizes either way.
+"""
+import numpy as np
+
+NS_PER_DAY = 86_400_000_000_000
+J2000 = np.datetime64('2000-01-01T12:00:00', 'ns')
+
+
+def julian_century(when: np.ndarray) -> np.ndarray:
+    """Julian centuries since the J2000 epoch.
+
+    :param when:
+        numpy.datetime64 value or array (assumed UTC).
+    :return:
+        Fractional centuries as float64.
+    """
+    ns = (when.astype('datetime64[ns]') - J2000).astype(np.int64)
+    return ns / NS_PER_DAY / 36525
+
+
+def sun_position(jc: np.ndarray) -> tuple:
+    """Solar declination and equation of time.
+
+    :param jc:
+        Julian centuries since J2000 (see julian_century).
+    :return:
+        Tuple of (declination in radians, equation of time in minutes).
+    """
+    mean_long = np.radians(
+        (280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360
+    )
+    mean_anom = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    eccent = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+
+    center = np.radians(
+        np.sin(mean_anom) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+        + np.sin(2 * mean_anom) * (0.019993 - 0.000101 * jc)
+        + np.sin(3 * mean_anom) * 0.000289
+    )
+    omega = np.radians(125.04 - 1934.136 * jc)
+    app_long = mean_long + center - np.radians(0.00569 + 0.00478 * np.sin(omega))
+
+    mean_obliq = 23 + (26 + (
+        21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))
+    ) / 60) / 60
+    obliq = np.radians(mean_obliq) + np.radians(0.00256) * np.cos(omega)
+
+    declination = np.arcsin(np.sin(obliq) * np.sin(app_long))
+
+    y = np.tan(obliq / 2) ** 2
+    eot = 4 * np.degrees(
+        y * np.sin(2 * mean_long)
+        - 2 * eccent * np.sin(mean_anom)
+        + 4 * eccent * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+        - 0.5 * y ** 2 * np.sin(4 * mean_long)
+        - 1.25 * eccent ** 2 * np.sin(2 * mean_anom)
+    )
+    return declination, eot
+
+
+def altitude(when, lat: float, lon: float) -> np.ndarray:
+    """Solar altitude at the given instants.
+
+    :param when:
+        numpy.datetime64 value or array (assumed UTC).
+    :param lat:
+        Observer latitude in degrees.
+    :param lon:
+        Observer longitude in degrees (east positive).
+    :return:
+        Altitude of the Sun above the horizon in degrees.
+    """
+    when = np.asarray(when, dtype='datetime64[ns]')
+    declination, eot = sun_position(julian_century(when))
+
+    minutes = (when - when.astype('datetime64[D]')).astype(np.int64) / 60e9
+    true_solar = (minutes + eot + 4 * lon) % 1440
+    hour_angle = np.radians(true_solar / 4 - 180)
+
+    lat_r = np.radians(lat)
+    return np.degrees(np.arcsin(
+        np.sin(lat_r) * np.sin(declination)
+        + np.cos(lat_r) * np.cos(declination) * np.cos(hour_angle)
+    ))
+
+
+def rise_set(date, lat: float, lon: float, horizon: float) -> tuple:
+    """Crossing times of the Sun through a given altitude on a given day.
+
+    :param date:
+        datetime.date, numpy.datetime64 day, or array of days (UTC).
+    :param lat:
+        Observer latitude in degrees.
+    :param lon:
+        Observer longitude in degrees (east positive).
+    :param horizon:
+        Solar altitude of interest in degrees. 0 for sunrise/sunset,
+        negative values for the twilight boundaries.
+    :return:
+        Tuple of (rise, set) as numpy.datetime64[ns]. NaT where the Sun
+        never reaches the requested altitude.
+    """
+    midnight = np.asarray(date, dtype='datetime64[D]').astype('datetime64[ns]')
+    noon = midnight + NS_PER_DAY // 2
+    declination, eot = sun_position(julian_century(noon))
+
+    lat_r = np.radians(lat)
+    cos_ha = (
+        (np.sin(np.radians(horizon)) - np.sin(lat_r) * np.sin(declination))
+        / (np.cos(lat_r) * np.cos(declination))
+    )
+    with np.errstate(invalid='ignore'):
+        hour_angle = np.degrees(np.arccos(cos_ha))
+
+    solar_noon = midnight + (
+        ((720 - 4 * lon - eot) * 60e9).astype(np.int64).astype('timedelta64[ns]')
+    )
+    half_day = (hour_angle * 4 * 60e9).astype('timedelta64[ns]')
+    return solar_noon - half_day, solar_noon + half_day